@@ -3,10 +3,16 @@ import logging
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
 from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
+from flask.json.provider import DefaultJSONProvider
 import json
 from datetime import datetime
 import uuid
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
@@ -15,36 +21,75 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "mindwatch-dev-key-2024")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, deferring to the stdlib for options orjson lacks (e.g. indent)"""
+    
+    def dumps(self, obj, **kwargs):
+        if kwargs.keys() - {'separators', 'sort_keys'}:
+            return super().dumps(obj, **kwargs)
+        
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        return super().loads(s, **kwargs) if kwargs else orjson.loads(s)
+
+# Faster encoding for every jsonify / tojson when orjson is installed
+if orjson is not None:
+    app.json = ORJSONProvider(app)
+
 # Configuration
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'outputs'
 app.config['MODEL_FOLDER'] = 'models'
 
+# Downloads: let the front-end server send files instead of a worker thread.
+# X_ACCEL_REDIRECT_PREFIX is an nginx `internal` location aliased to the output folder,
+# e.g. `location /protected/ { internal; alias /srv/mindwatch/outputs/; }`.
+app.config['X_ACCEL_REDIRECT_PREFIX'] = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
+app.config['USE_X_SENDFILE'] = bool(os.environ.get('USE_X_SENDFILE'))  # Apache mod_xsendfile
+# SECURE_DOWNLOAD_PREFIX redirects downloads to short-lived signed URLs that nginx serves directly:
+#   location ~ ^/secure/[^/]+/(.+)$ {
+#       auth_request /verify; alias /srv/mindwatch/outputs/$1;
+#       sendfile on; tcp_nopush on; add_header Content-Disposition attachment;
+#   }
+#   location = /verify { internal; proxy_pass http://app/verify; proxy_pass_request_body off;
+#                        proxy_set_header X-Original-URI $request_uri; }
+app.config['SECURE_DOWNLOAD_PREFIX'] = os.environ.get('SECURE_DOWNLOAD_PREFIX')
+app.config['SECURE_DOWNLOAD_MAX_AGE'] = int(os.environ.get('SECURE_DOWNLOAD_MAX_AGE', 300))  # seconds
+
 # Allowed file extensions
-ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'wmv'}
-ALLOWED_IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'bmp', 'tiff'}
+ALLOWED_VIDEO_EXTENSIONS = frozenset({'mp4', 'avi', 'mov', 'mkv', 'wmv'})
+ALLOWED_IMAGE_EXTENSIONS = frozenset({'jpg', 'jpeg', 'png', 'bmp', 'tiff'})
+ALLOWED_EXTENSIONS = ALLOWED_VIDEO_EXTENSIONS | ALLOWED_IMAGE_EXTENSIONS
 
 # Create necessary directories
 for folder in [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER'], app.config['MODEL_FOLDER']]:
     os.makedirs(folder, exist_ok=True)
 
+def file_extension(filename):
+    """Lower-cased extension of a filename, or '' if it has none"""
+    _, dot, ext = filename.rpartition('.')
+    return ext.lower() if dot else ''
+
 def allowed_file(filename, file_type='all'):
     """Check if file extension is allowed"""
-    if '.' not in filename:
-        return False
-    
-    ext = filename.rsplit('.', 1)[1].lower()
+    ext = file_extension(filename)
     
     if file_type == 'video':
         return ext in ALLOWED_VIDEO_EXTENSIONS
     elif file_type == 'image':
         return ext in ALLOWED_IMAGE_EXTENSIONS
     else:
-        return ext in ALLOWED_VIDEO_EXTENSIONS.union(ALLOWED_IMAGE_EXTENSIONS)
+        return ext in ALLOWED_EXTENSIONS
 
 # Import routes
 from routes import *
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Threaded, no reloader: the reloader would load the model twice.
+    # Production runs under gunicorn (see gunicorn.conf.py).
+    app.run(host='0.0.0.0', port=5000, debug=bool(os.environ.get('DEBUG')), threaded=True, use_reloader=False)
@@ -0,0 +1,11 @@
+import os
+
+# Gunicorn settings, picked up automatically from the working directory.
+# A single process keeps the loaded model and live video progress shared
+# (progress stages can move to Redis via REDIS_URL); threads let uploads,
+# progress polling and downloads overlap with analysis in the background.
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = 1
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+timeout = 120
@@ -1,4 +1,7 @@
+import os
 from app import app
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Threaded, no reloader: the reloader would load the model twice.
+    # Production runs under gunicorn (see gunicorn.conf.py).
+    app.run(host='0.0.0.0', port=5000, debug=bool(os.environ.get('DEBUG')), threaded=True, use_reloader=False)
@@ -1,14 +1,17 @@
 import cv2
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-from collections import defaultdict, Counter
+from collections import Counter
 import json
+import logging
 import os
 from datetime import datetime
-import seaborn as sns
 from typing import Dict, List, Tuple, Any
 import warnings
+import queue
+import shutil
+import subprocess
+import threading
+import time
 import torch
 from PIL import Image
 import yaml
@@ -16,6 +19,178 @@ import io
 import base64
 warnings.filterwarnings('ignore')
 
+# Colors for different activities (BGR format for OpenCV)
+ACTIVITY_COLORS = {
+    'listening': (0, 255, 0),      # Green - Attentive
+    'reading': (255, 0, 0),        # Blue - Attentive  
+    'writing': (0, 0, 255),        # Red - Attentive
+    'sleeping': (128, 0, 128),     # Purple - Distracted
+    'using_mobile': (0, 0, 0),     # Black - Distracted
+    'turn': (0, 255, 255),         # Yellow - Distracted
+    'turning': (0, 255, 255),      # Yellow - Distracted
+    'student': (255, 255, 255)     # White - Neutral
+}
+DEFAULT_COLOR = (255, 255, 255)
+
+# Label drawing parameters
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+LABEL_FONT_SCALE = 0.6
+LABEL_FONT_THICKNESS = 2
+
+# Minimum seconds between progress callbacks while processing a video
+PROGRESS_INTERVAL = 0.25
+
+# Square model input size used by the GPU preprocessing path
+GPU_INPUT_SIZE = 640
+
+# JPEG quality for annotated images; ~3x smaller than OpenCV's default 95 with no visible loss
+JPEG_QUALITY = 85
+
+# ffmpeg H.264 encoders in order of preference, with the arguments each needs
+VIDEO_ENCODERS = {
+    'h264_nvenc': ['-c:v', 'h264_nvenc', '-preset', 'p1', '-tune', 'll'],
+    'h264_vaapi': ['-vaapi_device', '/dev/dri/renderD128', '-vf', 'format=nv12,hwupload', '-c:v', 'h264_vaapi'],
+    'libx264': ['-c:v', 'libx264', '-preset', 'veryfast'],
+}
+
+def select_video_encoder():
+    """
+    Pick the ffmpeg encoder for annotated videos, or None to use OpenCV's mp4v writer
+    
+    VIDEO_ENCODER overrides the choice ('mp4v' forces OpenCV). Otherwise the first
+    encoder this machine can actually use is chosen: NVENC on CUDA hosts, VAAPI
+    when a render node exists, then libx264.
+    """
+    requested = os.environ.get("VIDEO_ENCODER")
+    if requested == "mp4v" or not shutil.which("ffmpeg"):
+        return None
+    if requested in VIDEO_ENCODERS:
+        return requested
+    
+    try:
+        listing = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'],
+                                 capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    
+    usable = {
+        'h264_nvenc': torch.cuda.is_available(),
+        'h264_vaapi': os.path.exists('/dev/dri/renderD128'),
+        'libx264': True,
+    }
+    for encoder in VIDEO_ENCODERS:
+        if usable[encoder] and f" {encoder} " in listing:
+            return encoder
+    return None
+
+class FFmpegVideoWriter:
+    """Minimal cv2.VideoWriter replacement that pipes raw frames into an ffmpeg encoder"""
+    
+    def __init__(self, output_path: str, fps: float, frame_size: Tuple[int, int], encoder: str):
+        width, height = frame_size
+        # Planar YUV 4:2:0 is half the bytes of BGR24 but needs even dimensions
+        self.yuv = width % 2 == 0 and height % 2 == 0
+        command = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo', '-pix_fmt', 'yuv420p' if self.yuv else 'bgr24',
+            '-s', f"{width}x{height}", '-r', f"{fps}", '-i', '-',
+            *VIDEO_ENCODERS[encoder]
+        ]
+        if encoder != 'h264_vaapi':
+            if not self.yuv:
+                command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+            command += ['-pix_fmt', 'yuv420p']  # VAAPI surfaces are already NV12 after hwupload
+        command.append(output_path)
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, bufsize=1 << 20)
+    
+    def write(self, frame: np.ndarray):
+        if self.yuv:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420)
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError as e:
+            # ffmpeg died mid-video (unsupported encoder, failed hwupload, full disk)
+            raise RuntimeError(f"ffmpeg exited with code {self.process.wait()}") from e
+    
+    def release(self):
+        """Finish encoding; raises if ffmpeg failed, since its output is then truncated or empty"""
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass  # Already exited; the return code below says why
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {self.process.returncode}")
+
+# One tracked detection: 52 bytes per record instead of a nested dict. Confidence and
+# box stay float64 so the summary timeline keeps the detector's exact values.
+TRACK_DTYPE = np.dtype([('sid', 'i4'), ('frame', 'i4'), ('aid', 'i2'), ('pad', 'i2'),
+                        ('conf', 'f8'), ('x', 'f8'), ('y', 'f8'), ('w', 'f8'), ('h', 'f8')])
+
+def _summarize_tracks_numpy(sids, aids, attentive_mask, distracted_mask, num_students, num_activities):
+    """Per-student detection, attentive, distracted and per-activity counts using NumPy"""
+    totals = np.bincount(sids, minlength=num_students)
+    attentive = np.bincount(sids, weights=attentive_mask[aids], minlength=num_students).astype(np.int64)
+    distracted = np.bincount(sids, weights=distracted_mask[aids], minlength=num_students).astype(np.int64)
+    activity_counts = np.bincount(sids.astype(np.int64) * num_activities + aids,
+                                  minlength=num_students * num_activities).reshape(num_students, num_activities)
+    return totals, attentive, distracted, activity_counts
+
+try:
+    from numba import njit
+    
+    # app.py logs at DEBUG; keep the compiler's IR dumps out of it
+    logging.getLogger('numba').setLevel(logging.WARNING)
+    
+    @njit(cache=True)
+    def summarize_tracks(sids, aids, attentive_mask, distracted_mask, num_students, num_activities):
+        """Per-student detection, attentive, distracted and per-activity counts in a single pass"""
+        totals = np.zeros(num_students, dtype=np.int64)
+        attentive = np.zeros(num_students, dtype=np.int64)
+        distracted = np.zeros(num_students, dtype=np.int64)
+        activity_counts = np.zeros((num_students, num_activities), dtype=np.int64)
+        for i in range(sids.shape[0]):
+            sid = sids[i]
+            aid = aids[i]
+            totals[sid] += 1
+            activity_counts[sid, aid] += 1
+            if attentive_mask[aid]:
+                attentive[sid] += 1
+            if distracted_mask[aid]:
+                distracted[sid] += 1
+        return totals, attentive, distracted, activity_counts
+except ImportError:
+    njit = None
+    summarize_tracks = _summarize_tracks_numpy
+
+class TrackBuffer:
+    """Append-only store of tracked detections kept in fixed-size structured-array chunks"""
+    
+    def __init__(self, chunk_size: int = 4096):
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.current = np.empty(chunk_size, dtype=TRACK_DTYPE)
+        self.used = 0
+    
+    def __len__(self):
+        return len(self.chunks) * self.chunk_size + self.used
+    
+    def extend(self, records: np.ndarray):
+        """Copy a block of TRACK_DTYPE records into the buffer, starting new chunks as needed"""
+        start = 0
+        while start < len(records):
+            count = min(len(records) - start, self.chunk_size - self.used)
+            self.current[self.used:self.used + count] = records[start:start + count]
+            self.used += count
+            start += count
+            if self.used == self.chunk_size:
+                self.chunks.append(self.current)
+                self.current = np.empty(self.chunk_size, dtype=TRACK_DTYPE)
+                self.used = 0
+    
+    def to_array(self) -> np.ndarray:
+        """Return every stored record as one contiguous array"""
+        return np.concatenate(self.chunks + [self.current[:self.used]])
+
 class MindWatchAnalyzer:
     def __init__(self, model_path: str = None):
         """
@@ -25,6 +200,13 @@ class MindWatchAnalyzer:
             model_path: Path to your trained .pt model file
         """
         self.model_path = model_path or os.environ.get("MODEL_PATH") or "models/best.pt"
+        self.batch_size = 16  # Sampled frames per model call (multiple of 8 for FP16 kernels)
+        self.queue_size = 8  # Max frames buffered between video pipeline stages
+        
+        # Optional GPU-side preprocessing for YOLOv8 (MODEL_GPU_PREPROCESS=1 on CUDA hosts)
+        self.gpu_preprocess = os.environ.get("MODEL_GPU_PREPROCESS") == "1" and torch.cuda.is_available()
+        self.device = torch.device('cuda:0') if self.gpu_preprocess else None
+        self.staging = None  # Pinned host buffer reused across batches
         
         # Load YOLO model
         print(f"Loading model from: {self.model_path}")
@@ -35,6 +217,7 @@ class MindWatchAnalyzer:
                 self.model = YOLO(self.model_path)
                 self.model_type = "yolov8"
                 print("✓ YOLOv8 model loaded successfully")
+                self.load_tensorrt_engine(YOLO)
             else:
                 raise FileNotFoundError(f"Model file not found: {self.model_path}")
         except (ImportError, FileNotFoundError) as e:
@@ -58,9 +241,10 @@ class MindWatchAnalyzer:
         self.distracted_activities = ['sleeping', 'using_mobile', 'turn', 'turning']
         
         # Tracking variables
-        self.student_tracks = defaultdict(list)
+        self.student_tracks = TrackBuffer()
         self.frame_count = 0
         self.fps = 30  # Default FPS, will be updated for videos
+        self.mock_rng = np.random.default_rng()  # Random source for the demo detector
         
         # Results storage
         self.detection_results = []
@@ -78,193 +262,320 @@ class MindWatchAnalyzer:
         except:
             self.class_names = {0: 'listening', 1: 'reading', 2: 'sleeping',
                               3: 'student', 4: 'turn', 5: 'using_mobile', 6: 'writing'}
+        
+        # Integer activity ids used by the column-oriented student tracks
+        self.activity_names = dict(self.class_names)
+        self.activity_ids = {name: cid for cid, name in self.activity_names.items()}
+        self.attentive_ids = frozenset(self.get_activity_id(a) for a in self.attentive_activities)
+        self.distracted_ids = frozenset(self.get_activity_id(a) for a in self.distracted_activities)
+        
+        # Drawing lookups for annotate_frame, indexed by activity id
+        self.color_lut = [DEFAULT_COLOR] * (max(self.activity_names) + 1)
+        for activity_id, name in self.activity_names.items():
+            self.color_lut[activity_id] = ACTIVITY_COLORS.get(name, DEFAULT_COLOR)
+        self.label_sizes = {}
+        
+        # Compile (or load the cached) Numba summary kernel now rather than on the first video
+        if njit is not None:
+            mask = np.zeros(1, dtype=np.bool_)
+            summarize_tracks(np.zeros(1, dtype=np.int32), np.zeros(1, dtype=np.int64), mask, mask, 1, 1)
+    
+    def get_activity_id(self, activity: str) -> int:
+        """Map an activity name to its integer id, registering unseen names"""
+        activity_id = self.activity_ids.get(activity)
+        if activity_id is None:
+            activity_id = max(self.activity_names, default=-1) + 1
+            self.activity_names[activity_id] = activity
+            self.activity_ids[activity] = activity_id
+        return activity_id
     
-    def detect_objects(self, image_path: str, confidence: float = 0.4):
+    def load_tensorrt_engine(self, yolo_cls):
+        """
+        Swap the PyTorch YOLOv8 weights for a TensorRT engine when running on CUDA
+        
+        The engine is exported once and cached next to the .pt file. Set
+        MODEL_TENSORRT=0 to disable, and MODEL_TENSORRT_INT8_DATA to a dataset
+        YAML to build an INT8 engine calibrated on that data instead of FP16.
+        """
+        if os.environ.get("MODEL_TENSORRT", "1") == "0" or not torch.cuda.is_available():
+            return
+        
+        engine_path = os.path.splitext(self.model_path)[0] + ".engine"
+        int8_data = os.environ.get("MODEL_TENSORRT_INT8_DATA")
+        try:
+            if not os.path.exists(engine_path) or os.path.getmtime(engine_path) < os.path.getmtime(self.model_path):
+                print("Exporting TensorRT engine (one-time, this can take a few minutes)...")
+                export_args = {'format': 'engine', 'device': 0, 'imgsz': 640,
+                               'batch': self.batch_size, 'dynamic': True}
+                if int8_data:
+                    export_args.update(int8=True, data=int8_data)
+                else:
+                    export_args['half'] = True
+                engine_path = self.model.export(**export_args)
+            
+            self.model = yolo_cls(engine_path, task='detect')
+            print(f"✓ TensorRT engine loaded: {engine_path}")
+        except Exception as e:
+            print(f"TensorRT engine not available, using PyTorch weights: {e}")
+    
+    def detect_objects(self, image, confidence: float = 0.4):
         """
         Detect objects in a single image using local YOLO model
         
         Args:
-            image_path: Path to the image file
+            image: Path to the image file or a decoded BGR frame (np.ndarray)
             confidence: Confidence threshold (0.0-1.0)
             
         Returns:
             Detection results
         """
+        return self.detect_batch([image], confidence)[0]
+    
+    def detect_batch(self, images: list, confidence: float = 0.4) -> list:
+        """
+        Detect objects in several images with a single model call
+        
+        Args:
+            images: List of image paths or decoded BGR frames (np.ndarray)
+            confidence: Confidence threshold (0.0-1.0)
+            
+        Returns:
+            List of detection results, one per input image
+        """
         try:
             if self.model_type == "yolov8" and self.model:
-                # YOLOv8 inference
-                results = self.model(image_path, conf=confidence)
-                return self.parse_yolov8_results(results[0])
+                if self.gpu_preprocess and all(isinstance(image, np.ndarray) for image in images):
+                    try:
+                        return self.detect_batch_gpu(images, confidence)
+                    except Exception as e:
+                        print(f"GPU preprocessing failed, using standard inference: {e}")
+                        self.gpu_preprocess = False
+                
+                # YOLOv8 inference (accepts paths and BGR ndarrays natively)
+                results = self.model(images, conf=confidence)
+                return [self.parse_yolov8_results(result) for result in results]
             elif self.model_type == "yolov5" and self.model:
-                # YOLOv5 inference
-                results = self.model(image_path)
-                results.conf = confidence  # Set confidence threshold
-                return self.parse_yolov5_results(results)
+                # YOLOv5 inference (ndarrays are expected in RGB order)
+                images = [image[:, :, ::-1] if isinstance(image, np.ndarray) else image for image in images]
+                self.model.conf = confidence  # Set confidence threshold
+                results = self.model(images)
+                return [self.parse_yolov5_results(results, i) for i in range(len(images))]
             else:
                 # Mock detection for demo
-                return self.mock_detection(image_path)
+                return [self.mock_detection(image) for image in images]
         except Exception as e:
             print(f"Error in object detection: {e}")
-            return self.mock_detection(image_path)
+            return [self.mock_detection(image) for image in images]
     
-    def mock_detection(self, image_path: str):
-        """Generate mock detection results for demo purposes"""
-        import random
+    def preprocess_gpu(self, frames: list):
+        """
+        Letterbox a batch of equally sized BGR frames into a normalized RGB tensor on the GPU
         
-        # Load image to get dimensions
-        image = cv2.imread(image_path)
+        Frames are copied once into a reusable pinned uint8 staging buffer and uploaded
+        asynchronously; resizing, padding, channel swap and scaling all run on the device.
+        
+        Returns:
+            Tuple of (input tensor, scale, (pad_left, pad_top))
+        """
+        import torch.nn.functional as F
+        
+        batch = np.stack(frames)
+        if self.staging is None or self.staging.shape != batch.shape:
+            self.staging = torch.empty(batch.shape, dtype=torch.uint8, pin_memory=True)
+        self.staging.numpy()[...] = batch
+        x = self.staging.to(self.device, non_blocking=True)
+        
+        # NHWC BGR uint8 -> NCHW RGB float
+        x = x.permute(0, 3, 1, 2)[:, [2, 1, 0]].float()
+        
+        height, width = batch.shape[1:3]
+        scale = min(GPU_INPUT_SIZE / height, GPU_INPUT_SIZE / width)
+        new_height, new_width = round(height * scale), round(width * scale)
+        if (new_height, new_width) != (height, width):
+            x = F.interpolate(x, size=(new_height, new_width), mode='bilinear', align_corners=False)
+        
+        pad_left = (GPU_INPUT_SIZE - new_width) // 2
+        pad_top = (GPU_INPUT_SIZE - new_height) // 2
+        x = F.pad(x, (pad_left, GPU_INPUT_SIZE - new_width - pad_left,
+                      pad_top, GPU_INPUT_SIZE - new_height - pad_top), value=114.0)
+        
+        x = x * (1.0 / 255.0)
+        return x, scale, (pad_left, pad_top)
+    
+    def detect_batch_gpu(self, frames: list, confidence: float = 0.4) -> list:
+        """Run YOLOv8 on GPU-preprocessed frames, bypassing Ultralytics' per-image preprocessing"""
+        from ultralytics.utils import ops
+        
+        if self.model.predictor is None:
+            # First call builds the predictor and its AutoBackend (PyTorch or TensorRT)
+            self.model(frames[:1], conf=confidence, verbose=False)
+        backend = self.model.predictor.model
+        
+        x, scale, (pad_left, pad_top) = self.preprocess_gpu(frames)
+        if getattr(backend, 'fp16', False):
+            x = x.half()
+        
+        with torch.inference_mode():
+            preds = backend(x)
+        detections = ops.non_max_suppression(preds, conf_thres=confidence, iou_thres=0.7)
+        
+        height, width = frames[0].shape[:2]
+        results = []
+        for det in detections:
+            det = det.float().cpu().numpy()
+            boxes = det[:, :4]
+            # Undo letterbox padding and scaling back to source pixel coordinates
+            boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad_left) / scale).clip(0, width)
+            boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad_top) / scale).clip(0, height)
+            results.append(self.build_predictions(boxes, det[:, 4], det[:, 5]))
+        return results
+    
+    def mock_detection(self, image):
+        """Generate mock detection results for demo purposes"""
+        # Get dimensions (frames from the video loop are already decoded, so no I/O)
+        if not isinstance(image, np.ndarray):
+            image = cv2.imread(image)
         if image is None:
             return {'predictions': []}
         
         height, width = image.shape[:2]
         
-        # Generate 2-5 random detections
-        num_detections = random.randint(2, 5)
-        detections = []
+        # Generate 2-5 random detections, drawing all boxes at once
+        rng = self.mock_rng
+        num_detections = int(rng.integers(2, 5, endpoint=True))
         
         activities = ['listening', 'reading', 'writing', 'sleeping', 'using_mobile', 'turn']
         
-        for i in range(num_detections):
-            # Random position and size
-            x_center = random.randint(100, width - 100)
-            y_center = random.randint(100, height - 100)
-            w = random.randint(80, 150)
-            h = random.randint(120, 200)
-            
-            x1 = x_center - w // 2
-            y1 = y_center - h // 2
-            x2 = x_center + w // 2
-            y2 = y_center + h // 2
-            
-            activity = random.choice(activities)
-            confidence = random.uniform(0.6, 0.95)
-            
-            detections.append({
-                'class': activity,
-                'confidence': confidence,
-                'x': x_center,
-                'y': y_center,
-                'width': w,
-                'height': h,
-                'x1': x1,
-                'y1': y1,
-                'x2': x2,
-                'y2': y2
-            })
+        # Random position and size
+        x_center = rng.integers(100, width - 100, size=num_detections, endpoint=True)
+        y_center = rng.integers(100, height - 100, size=num_detections, endpoint=True)
+        w = rng.integers(80, 150, size=num_detections, endpoint=True)
+        h = rng.integers(120, 200, size=num_detections, endpoint=True)
+        rows = np.stack((x_center, y_center, w, h,
+                         x_center - w // 2, y_center - h // 2,
+                         x_center + w // 2, y_center + h // 2), axis=1).tolist()
+        
+        activity_choices = rng.integers(0, len(activities), size=num_detections).tolist()
+        confidences = rng.uniform(0.6, 0.95, size=num_detections).tolist()
+        
+        detections = [{
+            'class': activities[choice],
+            'confidence': confidence,
+            'x': row[0],
+            'y': row[1],
+            'width': row[2],
+            'height': row[3],
+            'x1': row[4],
+            'y1': row[5],
+            'x2': row[6],
+            'y2': row[7]
+        } for choice, confidence, row in zip(activity_choices, confidences, rows)]
         
         return {'predictions': detections}
     
     def parse_yolov8_results(self, result):
         """Parse YOLOv8 results to standard format"""
-        detections = []
+        if result.boxes is None or not len(result.boxes):
+            return {'predictions': []}
         
-        if result.boxes is not None:
-            boxes = result.boxes.xyxy.cpu().numpy()  # x1, y1, x2, y2
-            confidences = result.boxes.conf.cpu().numpy()
-            classes = result.boxes.cls.cpu().numpy().astype(int)
-            
-            for i in range(len(boxes)):
-                x1, y1, x2, y2 = boxes[i]
-                conf = confidences[i]
-                cls = classes[i]
-                
-                # Convert to center format
-                x_center = (x1 + x2) / 2
-                y_center = (y1 + y2) / 2
-                width = x2 - x1
-                height = y2 - y1
-                
-                class_name = self.class_names.get(cls, f"class_{cls}")
-                
-                detections.append({
-                    'class': class_name,
-                    'confidence': float(conf),
-                    'x': float(x_center),
-                    'y': float(y_center),
-                    'width': float(width),
-                    'height': float(height),
-                    'x1': float(x1),
-                    'y1': float(y1),
-                    'x2': float(x2),
-                    'y2': float(y2)
-                })
+        return self.build_predictions(
+            result.boxes.xyxy.cpu().numpy(),  # x1, y1, x2, y2
+            result.boxes.conf.cpu().numpy(),
+            result.boxes.cls.cpu().numpy()
+        )
+    
+    def build_predictions(self, boxes: np.ndarray, confidences: np.ndarray, classes: np.ndarray) -> dict:
+        """Build standard-format predictions from (N, 4) xyxy boxes, confidences and class ids"""
+        confidences = confidences.tolist()
+        classes = classes.astype(int).tolist()
+        
+        # Convert to center format for all boxes at once:
+        # columns are x_center, y_center, width, height, x1, y1, x2, y2
+        centers = (boxes[:, :2] + boxes[:, 2:]) * 0.5
+        sizes = boxes[:, 2:] - boxes[:, :2]
+        rows = np.hstack((centers, sizes, boxes)).tolist()
+        
+        # Resolve each distinct class name once
+        names = {cls: self.class_names.get(cls, f"class_{cls}") for cls in set(classes)}
+        
+        detections = [{
+            'class': names[cls],
+            'confidence': conf,
+            'x': row[0],
+            'y': row[1],
+            'width': row[2],
+            'height': row[3],
+            'x1': row[4],
+            'y1': row[5],
+            'x2': row[6],
+            'y2': row[7]
+        } for cls, conf, row in zip(classes, confidences, rows)]
         
         return {'predictions': detections}
     
-    def parse_yolov5_results(self, results):
-        """Parse YOLOv5 results to standard format"""
-        detections = []
-        
-        # Get pandas dataframe of results
-        df = results.pandas().xyxy[0]
+    def parse_yolov5_results(self, results, index: int = 0):
+        """Parse YOLOv5 results for the image at `index` to standard format"""
+        # Raw (N, 6) tensor: x1, y1, x2, y2, confidence, class
+        pred = results.xyxy[index].cpu().numpy()
         
-        for _, row in df.iterrows():
-            x1, y1, x2, y2 = row['xmin'], row['ymin'], row['xmax'], row['ymax']
-            conf = row['confidence']
-            cls = row['class']
-            
-            # Convert to center format
-            x_center = (x1 + x2) / 2
-            y_center = (y1 + y2) / 2
-            width = x2 - x1
-            height = y2 - y1
-            
-            class_name = row['name'] if 'name' in row else self.class_names.get(cls, f"class_{cls}")
-            
-            detections.append({
-                'class': class_name,
-                'confidence': float(conf),
-                'x': float(x_center),
-                'y': float(y_center),
-                'width': float(width),
-                'height': float(height),
-                'x1': float(x1),
-                'y1': float(y1),
-                'x2': float(x2),
-                'y2': float(y2)
-            })
-        
-        return {'predictions': detections}
+        return self.build_predictions(pred[:, :4], pred[:, 4], pred[:, 5])
     
-    def process_single_image(self, image_path: str, output_path: str = None):
+    def process_single_image(self, image_path: str, output_path: str = None, annotate: bool = True, save: bool = True):
         """
         Process a single image and generate annotated output
         
         Args:
             image_path: Path to input image
             output_path: Path to save annotated image
+            annotate: Draw detections on the image (skip when only the summary is needed)
+            save: Write the annotated image to `output_path`; when False the annotated
+                image is returned in memory as a base64 JPEG data URI instead
             
         Returns:
-            Tuple of (annotated_image_path, results, summary)
+            Tuple of (annotated_image_path or data URI, results, summary)
         """
         print("Processing single image...")
+        self.reset_analysis()
         
-        # Detect objects
-        results = self.detect_objects(image_path)
-        if not results or not results.get('predictions'):
-            print("No detections found")
-            return None, None, None
-        
-        # Load image
+        # Load image once and run detection on the decoded pixels
         image = cv2.imread(image_path)
         if image is None:
             print(f"Could not load image: {image_path}")
             return None, None, None
         
-        # Annotate image
-        annotated_image = self.annotate_frame(image, results)
+        # Detect objects
+        results = self.detect_objects(image)
+        if not results or not results.get('predictions'):
+            print("No detections found")
+            return None, None, None
         
-        # Save annotated image
-        if output_path and output_path.strip():
-            cv2.imwrite(output_path, annotated_image)
-            print(f"✓ Annotated image saved to: {output_path}")
+        annotated_output = None
+        if annotate:
+            # Annotate image (the decoded source is not needed afterwards)
+            annotated_image = self.annotate_frame(image, results, inplace=True)
+            
+            if save and output_path and output_path.strip():
+                # Save annotated image
+                cv2.imwrite(output_path, annotated_image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                print(f"✓ Annotated image saved to: {output_path}")
+                annotated_output = output_path
+            elif not save:
+                annotated_output = self.encode_image_data_uri(annotated_image)
         
         # Generate summary for single image
         summary = self.generate_image_summary(results)
         
-        return output_path, results, summary
+        return annotated_output, results, summary
+    
+    def encode_image_data_uri(self, image: np.ndarray) -> str:
+        """Encode an image as an in-memory JPEG data URI for sending straight to the browser"""
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if not ok:
+            return None
+        return "data:image/jpeg;base64," + base64.b64encode(buffer).decode('ascii')
     
-    def process_video(self, video_path: str, output_path: str = None, sample_rate: int = 5, progress_callback=None):
+    def process_video(self, video_path: str, output_path: str = None, sample_rate: int = 5, progress_callback=None,
+                      progress_value=None):
         """
         Process video file and generate annotated output with tracking
         
@@ -273,11 +584,14 @@ class MindWatchAnalyzer:
             output_path: Path to save annotated video
             sample_rate: Process every nth frame
             progress_callback: Function to call with progress updates
+            progress_value: Shared float (e.g. multiprocessing.Value('f')) that is overwritten
+                with the current progress percentage; readers poll it at their own cadence
             
         Returns:
             Tuple of (output_path, summary)
         """
         print("🎥 Processing video...")
+        self.reset_analysis()
         
         # Open video
         cap = cv2.VideoCapture(video_path)
@@ -290,51 +604,155 @@ class MindWatchAnalyzer:
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        codec = int(cap.get(cv2.CAP_PROP_FOURCC)).to_bytes(4, 'little').decode('ascii', errors='replace').strip('\x00')
         
-        print(f"📹 Video: {width}x{height}, {self.fps:.1f} FPS, {total_frames} frames")
+        print(f"📹 Video: {width}x{height}, {self.fps:.1f} FPS, {total_frames} frames, codec {codec or 'unknown'}")
         print(f"⏱  Duration: {total_frames/self.fps:.1f} seconds")
         print(f"🔄 Processing every {sample_rate} frames for efficiency")
         
         # Setup video writer if output path provided
-        fourcc = cv2.VideoWriter.fourcc(*'mp4v')
         out = None
         if output_path and output_path.strip():
-            out = cv2.VideoWriter(output_path, fourcc, self.fps/sample_rate, (width, height))
+            encoder = select_video_encoder()
+            if encoder:
+                print(f"🎞  Encoding with ffmpeg {encoder}")
+                out = FFmpegVideoWriter(output_path, self.fps/sample_rate, (width, height), encoder)
+            else:
+                fourcc = cv2.VideoWriter.fourcc(*'mp4v')
+                out = cv2.VideoWriter(output_path, fourcc, self.fps/sample_rate, (width, height))
+        
+        # Decode, inference and annotation/encoding run as a three-stage
+        # pipeline; bounded queues keep at most a few batches in memory.
+        frame_queue = queue.Queue(maxsize=self.queue_size)
+        result_queue = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        stats = {'processed_frames': 0}
+        
+        stages = [
+            threading.Thread(target=self._decode_stage, args=(cap, sample_rate, frame_queue, errors),
+                             name='mindwatch-decode', daemon=True),
+            threading.Thread(target=self._inference_stage, args=(frame_queue, result_queue, errors),
+                             name='mindwatch-inference', daemon=True),
+            threading.Thread(target=self._writer_stage,
+                             args=(result_queue, out, total_frames, progress_callback, progress_value,
+                                   stats, errors),
+                             name='mindwatch-writer', daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        for stage in stages:
+            stage.join()
+        
+        processed_frames = stats['processed_frames']
         
-        frame_number = 0
-        processed_frames = 0
+        # Cleanup
+        cap.release()
+        if out:
+            out.release()
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Process every nth frame based on sample_rate
-            if frame_number % sample_rate == 0:
-                # Save frame temporarily for detection
-                temp_frame_path = f"temp_frame_{frame_number}.jpg"
-                cv2.imwrite(temp_frame_path, frame)
-                
-                # Detect objects
-                results = self.detect_objects(temp_frame_path)
+        if errors:
+            raise errors[0]
+        
+        print(f"✅ Video processing complete! Processed {processed_frames} frames.")
+        
+        # Generate comprehensive summary
+        summary = self.generate_video_summary()
+        
+        return output_path, summary
+    
+    def _decode_stage(self, cap, sample_rate: int, frame_queue: queue.Queue, errors: list):
+        """Pipeline stage: decode sampled frames and push (frame_number, frame)"""
+        frame_number = 0
+        try:
+            while True:
+                # Advance without decoding; only sampled frames are retrieved.
+                # Intra-only codecs (MJPEG) gain the most, H.264/H.265 still
+                # have to decode reference frames internally.
+                ret = cap.grab()
+                if not ret:
+                    break
                 
-                # Clean up temp file
-                if os.path.exists(temp_frame_path):
-                    os.remove(temp_frame_path)
+                # Process every nth frame based on sample_rate
+                if frame_number % sample_rate == 0:
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    frame_queue.put((frame_number, frame))
                 
+                frame_number += 1
+        except Exception as e:
+            errors.append(e)
+        finally:
+            frame_queue.put(None)
+    
+    def _inference_stage(self, frame_queue: queue.Queue, result_queue: queue.Queue, errors: list):
+        """Pipeline stage: batch frames through the model and push (frame_number, frame, results)"""
+        frames_buf = []
+        frame_numbers = []
+        failed = False
+        
+        def flush():
+            batch_results = self.detect_batch(frames_buf)
+            
+            for frame_number, frame, results in zip(frame_numbers, frames_buf, batch_results):
                 if results and results.get('predictions'):
                     # Update tracking
                     self.update_tracking(results, frame_number)
                     
-                    # Annotate frame
-                    annotated_frame = self.annotate_frame(frame, results)
-                    
                     # Store results
                     self.detection_results.append({
                         'frame': frame_number,
                         'timestamp': frame_number / self.fps,
                         'detections': results
                     })
+                result_queue.put((frame_number, frame, results))
+            
+            frames_buf.clear()
+            frame_numbers.clear()
+        
+        try:
+            while True:
+                item = frame_queue.get()
+                if item is None:
+                    break
+                if failed:
+                    continue  # Keep draining so the decoder never blocks
+                
+                try:
+                    frame_numbers.append(item[0])
+                    frames_buf.append(item[1])
+                    if len(frames_buf) >= self.batch_size:
+                        flush()
+                except Exception as e:
+                    errors.append(e)
+                    failed = True
+            
+            if frames_buf and not failed:
+                flush()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            result_queue.put(None)
+    
+    def _writer_stage(self, result_queue: queue.Queue, out, total_frames: int, progress_callback, progress_value,
+                      stats: dict, errors: list):
+        """Pipeline stage: annotate frames, write them out and report progress"""
+        failed = False
+        inv_total = 100.0 / total_frames if total_frames > 0 else 0.0
+        last_callback = 0.0
+        
+        while True:
+            item = result_queue.get()
+            if item is None:
+                break
+            if failed:
+                continue  # Keep draining so inference never blocks
+            
+            try:
+                frame_number, frame, results = item
+                if results and results.get('predictions'):
+                    # Annotate frame
+                    annotated_frame = self.annotate_frame(frame, results, inplace=True)
                 else:
                     annotated_frame = frame
                 
@@ -342,55 +760,49 @@ class MindWatchAnalyzer:
                 if out:
                     out.write(annotated_frame)
                 
-                processed_frames += 1
+                stats['processed_frames'] += 1
                 
-                # Progress update
-                if progress_callback and processed_frames % 10 == 0:
-                    progress = (frame_number / total_frames) * 100
-                    progress_callback(progress)
-            
-            frame_number += 1
-        
-        # Cleanup
-        cap.release()
-        if out:
-            out.release()
-        
-        print(f"✅ Video processing complete! Processed {processed_frames} frames.")
-        
-        # Generate comprehensive summary
-        summary = self.generate_video_summary()
-        
-        return output_path, summary
+                # Progress update: check every 16 frames, call back at most every PROGRESS_INTERVAL seconds
+                if (stats['processed_frames'] & 0xF) == 0:
+                    if progress_value is not None:
+                        progress_value.value = frame_number * inv_total
+                    if progress_callback:
+                        now = time.monotonic()
+                        if now - last_callback >= PROGRESS_INTERVAL:
+                            last_callback = now
+                            progress_callback(frame_number * inv_total)
+            except Exception as e:
+                errors.append(e)
+                failed = True
     
-    def annotate_frame(self, frame: np.ndarray, results: dict) -> np.ndarray:
-        """Annotate frame with detection results"""
-        annotated_frame = frame.copy()
+    def annotate_frame(self, frame: np.ndarray, results: dict, inplace: bool = False) -> np.ndarray:
+        """
+        Annotate frame with detection results
+        
+        Args:
+            frame: BGR frame to annotate
+            results: Detection results
+            inplace: Draw directly on `frame` instead of a copy (caller no longer needs the original)
+        """
+        annotated_frame = frame if inplace else frame.copy()
         
         if 'predictions' not in results:
             return annotated_frame
         
-        # Define colors for different activities (BGR format for OpenCV)
-        colors = {
-            'listening': (0, 255, 0),      # Green - Attentive
-            'reading': (255, 0, 0),        # Blue - Attentive  
-            'writing': (0, 0, 255),        # Red - Attentive
-            'sleeping': (128, 0, 128),     # Purple - Distracted
-            'using_mobile': (0, 0, 0),     # Black - Distracted
-            'turn': (0, 255, 255),         # Yellow - Distracted
-            'turning': (0, 255, 255),      # Yellow - Distracted
-            'student': (255, 255, 255)     # White - Neutral
-        }
-        
         for prediction in results['predictions']:
             class_name = prediction['class']
             confidence = prediction['confidence']
+            # Ids are resolved by update_tracking on the inference thread; only read the mapping here
+            activity_id = prediction.get('activity_id', self.activity_ids.get(class_name))
             
             # Use provided coordinates
             x1, y1, x2, y2 = int(prediction['x1']), int(prediction['y1']), int(prediction['x2']), int(prediction['y2'])
             
             # Get color for this class
-            color = colors.get(class_name, (255, 255, 255))
+            if activity_id is not None and activity_id < len(self.color_lut):
+                color = self.color_lut[activity_id]
+            else:
+                color = DEFAULT_COLOR
             
             # Draw bounding box
             thickness = max(2, int(confidence * 4))
@@ -398,18 +810,19 @@ class MindWatchAnalyzer:
             
             # Draw label with background
             label = f"{class_name}: {confidence:.2f}"
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            font_scale = 0.6
-            font_thickness = 2
             
-            # Get text size
-            (text_width, text_height), baseline = cv2.getTextSize(label, font, font_scale, font_thickness)
+            # Get text size (constant per class: Hershey digits share one advance width)
+            label_size = self.label_sizes.get(class_name)
+            if label_size is None:
+                label_size = cv2.getTextSize(f"{class_name}: 0.00", LABEL_FONT, LABEL_FONT_SCALE, LABEL_FONT_THICKNESS)[0]
+                self.label_sizes[class_name] = label_size
+            text_width, text_height = label_size
             
             # Draw background rectangle
             cv2.rectangle(annotated_frame, (x1, y1 - text_height - 10), (x1 + text_width, y1), color, -1)
             
             # Draw text
-            cv2.putText(annotated_frame, label, (x1, y1 - 5), font, font_scale, (255, 255, 255), font_thickness)
+            cv2.putText(annotated_frame, label, (x1, y1 - 5), LABEL_FONT, LABEL_FONT_SCALE, (255, 255, 255), LABEL_FONT_THICKNESS)
         
         return annotated_frame
     
@@ -418,21 +831,25 @@ class MindWatchAnalyzer:
         if 'predictions' not in results:
             return
         
-        for i, prediction in enumerate(results['predictions']):
-            student_id = f"student_{i}"  # Simple ID assignment
-            
-            self.student_tracks[student_id].append({
-                'frame': frame_number,
-                'timestamp': frame_number / self.fps,
-                'activity': prediction['class'],
-                'confidence': prediction['confidence'],
-                'position': {
-                    'x': prediction['x'],
-                    'y': prediction['y'],
-                    'width': prediction['width'],
-                    'height': prediction['height']
-                }
-            })
+        predictions = results['predictions']
+        
+        # Register activity ids here, on the inference thread, and hand them to annotate_frame
+        # with the predictions so the writer thread never mutates the id mapping
+        for prediction in predictions:
+            prediction['activity_id'] = self.get_activity_id(prediction['class'])
+        
+        records = np.empty(len(predictions), dtype=TRACK_DTYPE)
+        records['sid'] = np.arange(len(predictions))  # Simple ID assignment: student_{i}
+        records['frame'] = frame_number
+        records['aid'] = [prediction['activity_id'] for prediction in predictions]
+        records['pad'] = 0
+        records['conf'] = [prediction['confidence'] for prediction in predictions]
+        records['x'] = [prediction['x'] for prediction in predictions]
+        records['y'] = [prediction['y'] for prediction in predictions]
+        records['w'] = [prediction['width'] for prediction in predictions]
+        records['h'] = [prediction['height'] for prediction in predictions]
+        
+        self.student_tracks.extend(records)
     
     def generate_image_summary(self, results: dict) -> dict:
         """Generate summary for single image analysis"""
@@ -441,10 +858,11 @@ class MindWatchAnalyzer:
         
         activities = [pred['class'] for pred in results['predictions']]
         activity_counts = Counter(activities)
+        activity_ids = [self.get_activity_id(activity) for activity in activities]
         
         total_students = len(results['predictions'])
-        attentive_count = sum(1 for activity in activities if activity in self.attentive_activities)
-        distracted_count = sum(1 for activity in activities if activity in self.distracted_activities)
+        attentive_count = sum(1 for activity_id in activity_ids if activity_id in self.attentive_ids)
+        distracted_count = sum(1 for activity_id in activity_ids if activity_id in self.distracted_ids)
         
         summary = {
             'total_students': total_students,
@@ -465,16 +883,31 @@ class MindWatchAnalyzer:
         # Analyze each student's behavior over time
         student_analysis = {}
         
-        for student_id, tracks in self.student_tracks.items():
-            if not tracks:
-                continue
-            
-            activities = [track['activity'] for track in tracks]
-            activity_counts = Counter(activities)
+        # Group records by student id; a stable sort keeps each student's frames in order
+        tracks = self.student_tracks.to_array()
+        tracks = tracks[np.argsort(tracks['sid'], kind='stable')]
+        student_ids, starts = np.unique(tracks['sid'], return_index=True)
+        
+        # Count everything per student in one pass over the track columns
+        num_activities = max(self.activity_names) + 1
+        attentive_mask = np.zeros(num_activities, dtype=np.bool_)
+        attentive_mask[list(self.attentive_ids)] = True
+        distracted_mask = np.zeros(num_activities, dtype=np.bool_)
+        distracted_mask[list(self.distracted_ids)] = True
+        num_students = int(student_ids[-1]) + 1 if len(student_ids) else 0
+        # Contiguous columns match the signature compiled by the warm-up in __init__
+        totals, attentive_counts, distracted_counts, activity_counts = summarize_tracks(
+            np.ascontiguousarray(tracks['sid']), tracks['aid'].astype(np.int64), attentive_mask, distracted_mask,
+            num_students, num_activities)
+        
+        for sid, track in zip(student_ids.tolist(), np.split(tracks, starts[1:])):
+            student_id = f"student_{sid}"
+            frames, activity_ids, confidences = track['frame'], track['aid'], track['conf']
+            positions = zip(track['x'].tolist(), track['y'].tolist(), track['w'].tolist(), track['h'].tolist())
             
-            total_detections = len(tracks)
-            attentive_detections = sum(1 for activity in activities if activity in self.attentive_activities)
-            distracted_detections = sum(1 for activity in activities if activity in self.distracted_activities)
+            total_detections = int(totals[sid])
+            attentive_detections = int(attentive_counts[sid])
+            distracted_detections = int(distracted_counts[sid])
             
             # Calculate percentages
             attentive_percentage = (attentive_detections / total_detections * 100) if total_detections > 0 else 0
@@ -483,13 +916,24 @@ class MindWatchAnalyzer:
             # Classify student
             classification = "Attentive" if attentive_percentage > distracted_percentage else "Distracted"
             
+            # Expand the columns back into per-detection records for the JSON summary
+            timeline = [{
+                'frame': frame,
+                'timestamp': frame / self.fps,
+                'activity': self.activity_names[activity_id],
+                'confidence': confidence,
+                'position': {'x': x, 'y': y, 'width': w, 'height': h}
+            } for frame, activity_id, confidence, (x, y, w, h) in zip(
+                frames.tolist(), activity_ids.tolist(), confidences.tolist(), positions)]
+            
             student_analysis[student_id] = {
                 'total_detections': total_detections,
                 'attentive_percentage': attentive_percentage,
                 'distracted_percentage': distracted_percentage,
                 'classification': classification,
-                'activity_breakdown': dict(activity_counts),
-                'timeline': tracks
+                'activity_breakdown': {self.activity_names[activity_id]: int(count)
+                                       for activity_id, count in enumerate(activity_counts[sid]) if count},
+                'timeline': timeline
             }
         
         # Overall statistics
@@ -508,7 +952,7 @@ class MindWatchAnalyzer:
     
     def reset_analysis(self):
         """Reset analysis state for new processing"""
-        self.student_tracks = defaultdict(list)
+        self.student_tracks = TrackBuffer()
         self.frame_count = 0
         self.detection_results = []
         self.student_summaries = {}
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Entries outlive any realistic processing run, then expire with the session
+PROGRESS_TTL = 86400
+PROGRESS_MAXSIZE = 1024
+REDIS_KEY_PREFIX = "mw:progress:"
+
+class LocalProgressStore:
+    """Bounded, thread-safe progress entries for a single-process deployment"""
+
+    def __init__(self, maxsize=PROGRESS_MAXSIZE, ttl=PROGRESS_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()  # sid -> (expires_at, fields), oldest first
+        self.listeners = {}  # sid -> set of Events, one per open subscription
+
+    def get(self, session_id):
+        """Copy of a session's progress fields, or None if unknown or expired"""
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[session_id]
+                return None
+            return dict(entry[1])
+
+    def set(self, session_id, **fields):
+        """Replace a session's progress fields"""
+        with self.lock:
+            self._store(session_id, fields)
+
+    def update(self, session_id, **fields):
+        """Merge fields into a session's progress entry, creating it if needed"""
+        with self.lock:
+            current = self.get(session_id) or {}
+            current.update(fields)
+            self._store(session_id, current)
+
+    def _store(self, session_id, fields):
+        self.entries.pop(session_id, None)
+        self.entries[session_id] = (time.monotonic() + self.ttl, fields)
+
+        # Evict expired entries first, then the oldest ones beyond maxsize
+        now = time.monotonic()
+        while self.entries:
+            oldest_id, (expires_at, _) = next(iter(self.entries.items()))
+            if expires_at >= now and len(self.entries) <= self.maxsize:
+                break
+            del self.entries[oldest_id]
+
+    def publish(self, session_id):
+        """Wake every subscription open on this session"""
+        with self.lock:
+            for event in self.listeners.get(session_id, ()):
+                event.set()
+
+    def subscribe(self, session_id):
+        """Open a subscription whose wait() returns early when the session is published"""
+        return _LocalSubscription(self, session_id)
+
+class _LocalSubscription:
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+        self.event = threading.Event()
+        with store.lock:
+            store.listeners.setdefault(session_id, set()).add(self.event)
+
+    def wait(self, timeout):
+        self.event.wait(timeout)
+        self.event.clear()
+
+    def close(self):
+        with self.store.lock:
+            listeners = self.store.listeners.get(self.session_id)
+            if listeners is not None:
+                listeners.discard(self.event)
+                if not listeners:
+                    del self.store.listeners[self.session_id]
+
+class RedisProgressStore:
+    """Progress entries kept in Redis, shared by every worker process"""
+
+    def __init__(self, client, ttl=PROGRESS_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, session_id):
+        """Progress fields for a session, or None if unknown or expired"""
+        fields = self.client.hgetall(REDIS_KEY_PREFIX + session_id)
+        if not fields:
+            return None
+        return {key.decode(): json.loads(value) for key, value in fields.items()}
+
+    def set(self, session_id, **fields):
+        """Replace a session's progress fields"""
+        key = REDIS_KEY_PREFIX + session_id
+        with self.client.pipeline() as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping=self._encode(fields))
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    def update(self, session_id, **fields):
+        """Merge fields into a session's progress hash, refreshing its TTL"""
+        key = REDIS_KEY_PREFIX + session_id
+        with self.client.pipeline() as pipe:
+            pipe.hset(key, mapping=self._encode(fields))
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    @staticmethod
+    def _encode(fields):
+        # Hash values are strings, so each field is stored as JSON
+        return {key: json.dumps(value) for key, value in fields.items()}
+
+    def publish(self, session_id):
+        """Notify subscribers in any process that this session changed"""
+        self.client.publish(REDIS_KEY_PREFIX + session_id, 1)
+
+    def subscribe(self, session_id):
+        """Open a Pub/Sub subscription whose wait() returns early on publish"""
+        return _RedisSubscription(self.client, REDIS_KEY_PREFIX + session_id)
+
+class _RedisSubscription:
+    def __init__(self, client, channel):
+        self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(channel)
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            if self.pubsub.get_message(timeout=remaining) is not None:
+                break
+
+    def close(self):
+        self.pubsub.close()
+
+def create_progress_store():
+    """Use Redis when REDIS_URL is set and redis is installed, otherwise keep progress in-process"""
+    redis_url = os.environ.get("REDIS_URL")
+    if redis_url and redis is not None:
+        try:
+            client = redis.Redis.from_url(redis_url)
+            client.ping()
+            print("✓ Progress store: Redis")
+            return RedisProgressStore(client)
+        except redis.RedisError as e:
+            print(f"Redis unavailable ({e}), keeping progress in-process")
+    elif redis_url:
+        print("REDIS_URL is set but redis is not installed, keeping progress in-process")
+    return LocalProgressStore()
@@ -1,17 +1,73 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, session
+from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, session, Response
 from werkzeug.utils import secure_filename
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 import os
 import uuid
 import json
 from datetime import datetime
 import threading
+import multiprocessing
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import time
-from app import app, allowed_file
+import mimetypes
+from urllib.parse import unquote
+from app import app, allowed_file, file_extension, ALLOWED_VIDEO_EXTENSIONS
 from mindwatch_analyzer import MindWatchAnalyzer
-from utils import generate_pdf_report, cleanup_old_files
+from utils import generate_pdf_report, cleanup_old_files, enrich_summary, atomic_output
+from progress_store import create_progress_store
+from tasks import process_file_task
 
-# Global progress tracking
-progress_tracker = {}
+try:
+    from apscheduler.schedulers.background import BackgroundScheduler
+except ImportError:
+    BackgroundScheduler = None
+
+# Signs the file name in /secure download URLs (see SECURE_DOWNLOAD_PREFIX)
+download_serializer = URLSafeTimedSerializer(app.secret_key, salt='mindwatch-download')
+
+# Seconds between runs of cleanup_old_files
+CLEANUP_INTERVAL = 3600
+
+# Bytes read from the request body per write in /upload_stream
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Progress entries per session (Redis when configured, otherwise bounded in-process)
+progress_store = create_progress_store()
+# /api/analytics payloads for completed sessions, oldest evicted first
+ANALYTICS_CACHE_SIZE = 1024
+_analytics_cache = {}
+_analytics_cache_lock = threading.Lock()
+# Raw video progress (0-100) per session, written by the analyzer and read by /progress
+progress_values = {}
+
+# Bounded pool for in-process jobs; analysis itself is still serialized per model
+EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get('MW_WORKERS', 2)), thread_name_prefix='mw-proc')
+# PDF reports run on their own worker so they never queue behind a video analysis
+REPORT_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mw-report')
+
+DEFAULT_MODEL_PATH = os.environ.get("MODEL_PATH", "models/best.pt")
+_analyzer_load_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=2)
+def _load_analyzer(model_path):
+    return MindWatchAnalyzer(model_path), threading.Semaphore(1)
+
+def get_analyzer(model_path=DEFAULT_MODEL_PATH):
+    """
+    Return the process-wide (analyzer, semaphore) pair for a model, loading it on first use
+    
+    The analyzer keeps per-run tracking state, so callers hold the semaphore while analyzing.
+    """
+    with _analyzer_load_lock:  # Concurrent first requests must not load the weights twice
+        return _load_analyzer(model_path)
+
+# Warm the default model at startup so the first upload doesn't pay the load
+# (unless jobs go to a Celery worker, which loads its own copy)
+if process_file_task is None:
+    get_analyzer()
+elif not os.environ.get("REDIS_URL"):
+    print("Celery dispatch without REDIS_URL: progress from the worker won't reach this process")
 
 @app.route('/')
 def index():
@@ -39,8 +95,9 @@ def upload_file():
         # Generate unique filename
         session_id = str(uuid.uuid4())
         if file.filename:
+            # Take the extension from the original name; secure_filename can drop it (e.g. non-ASCII names)
             filename = secure_filename(file.filename)
-            file_ext = filename.rsplit('.', 1)[1].lower()
+            file_ext = file_extension(file.filename)
         else:
             flash('Invalid filename', 'error')
             return redirect(request.url)
@@ -48,13 +105,10 @@ def upload_file():
         
         # Save file
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
+        with atomic_output(file_path) as tmp_path:
+            file.save(tmp_path)
         
-        # Store session info
-        session['session_id'] = session_id
-        session['filename'] = filename
-        session['file_path'] = file_path
-        session['file_type'] = 'video' if file_ext in {'mp4', 'avi', 'mov', 'mkv', 'wmv'} else 'image'
+        register_upload(session_id, filename, file_path, file_ext)
         
         flash('File uploaded successfully!', 'success')
         return redirect(url_for('process_file'))
@@ -62,6 +116,36 @@ def upload_file():
         flash('Invalid file type. Please upload a video (MP4, AVI, MOV) or image (JPG, PNG) file.', 'error')
         return redirect(request.url)
 
+@app.route('/upload_stream', methods=['POST'])
+def upload_stream():
+    """Handle a raw-body upload, streaming it straight to disk in fixed-size chunks"""
+    original_filename = unquote(request.headers.get('X-Filename', ''))
+    if not allowed_file(original_filename):
+        return jsonify({'error': 'Invalid file type. Please upload a video (MP4, AVI, MOV) or image (JPG, PNG) file.'}), 400
+    
+    # Generate unique filename
+    session_id = str(uuid.uuid4())
+    filename = secure_filename(original_filename)
+    file_ext = file_extension(original_filename)
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{session_id}.{file_ext}")
+    
+    # Save file without buffering the whole body
+    with atomic_output(file_path) as tmp_path, open(tmp_path, 'wb') as f:
+        while chunk := request.stream.read(UPLOAD_CHUNK_SIZE):
+            f.write(chunk)
+    
+    register_upload(session_id, filename, file_path, file_ext)
+    
+    flash('File uploaded successfully!', 'success')
+    return jsonify({'session_id': session_id, 'redirect': url_for('process_file')})
+
+def register_upload(session_id, filename, file_path, file_ext):
+    """Store session info for an uploaded file"""
+    session['session_id'] = session_id
+    session['filename'] = filename
+    session['file_path'] = file_path
+    session['file_type'] = 'video' if file_ext in ALLOWED_VIDEO_EXTENSIONS else 'image'
+
 @app.route('/process')
 def process_file():
     """Process uploaded file"""
@@ -82,75 +166,147 @@ def start_processing():
     file_type = session['file_type']
     
     # Initialize progress tracking
-    progress_tracker[session_id] = {'progress': 0, 'status': 'starting', 'error': None}
+    progress_store.set(session_id, progress=0, status='starting', error=None)
+    _analytics_cache.pop(session_id, None)  # Reprocessing replaces the summary
     
-    # Start processing in background thread
-    thread = threading.Thread(target=process_file_async, args=(session_id, file_path, file_type))
-    thread.daemon = True
-    thread.start()
+    # Hand off to the Celery worker pool when configured, else the in-process pool
+    if process_file_task is not None:
+        process_file_task.delay(session_id, file_path, file_type)
+    else:
+        EXECUTOR.submit(process_file_async, session_id, file_path, file_type)
     
     return jsonify({'message': 'Processing started', 'session_id': session_id})
 
-def process_file_async(session_id, file_path, file_type):
-    """Process file asynchronously"""
+def process_file_async(session_id, file_path, file_type, live_progress=True):
+    """
+    Process file asynchronously
+    
+    With live_progress, video progress goes through a shared float read by this process;
+    otherwise (e.g. in a Celery worker) it is written to the progress store as it changes.
+    """
     try:
-        # Initialize analyzer
-        model_path = os.environ.get("MODEL_PATH", "models/best.pt")
-        analyzer = MindWatchAnalyzer(model_path)
+        # Shared analyzer, loaded once per model
+        analyzer, analyzer_semaphore = get_analyzer(DEFAULT_MODEL_PATH)
         
-        # Update progress
-        progress_tracker[session_id]['status'] = 'analyzing'
-        progress_tracker[session_id]['progress'] = 10
+        # Waiting for the shared analyzer if another job holds it
+        progress_store.update(session_id, status='queued')
+        progress_store.publish(session_id)
         
         # Define output paths
         output_filename = f"{session_id}_output"
         
-        if file_type == 'video':
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{output_filename}.mp4")
-            
-            def update_progress(progress):
-                progress_tracker[session_id]['progress'] = 10 + (progress * 0.8)  # 10-90%
+        with analyzer_semaphore:
+            # Update progress
+            progress_store.update(session_id, status='analyzing', progress=10)
+            progress_store.publish(session_id)
             
-            # Process video
-            result_path, summary = analyzer.process_video(
-                file_path, output_path, sample_rate=5, progress_callback=update_progress
-            )
-        else:
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{output_filename}.jpg")
-            
-            # Process image
-            result_path, results, summary = analyzer.process_single_image(file_path, output_path)
+            if file_type == 'video':
+                output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{output_filename}.mp4")
+                
+                if live_progress:
+                    progress_values[session_id] = multiprocessing.Value('f', 0.0, lock=False)
+                    progress_kwargs = {'progress_value': progress_values[session_id]}
+                else:
+                    progress_kwargs = {'progress_callback': lambda p: report_video_progress(session_id, p)}
+                
+                # Process video
+                result_path, summary = analyzer.process_video(
+                    file_path, output_path, sample_rate=5, **progress_kwargs
+                )
+            else:
+                output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{output_filename}.jpg")
+                
+                # Process image
+                result_path, results, summary = analyzer.process_single_image(file_path, output_path)
         
-        # Update progress
-        progress_tracker[session_id]['progress'] = 90
-        progress_tracker[session_id]['status'] = 'generating_report'
+        # The analyzer returns no summary for an image without detections or an unreadable file
+        if summary is None:
+            raise ValueError('No students detected in the image' if file_type == 'image'
+                             else 'Could not read the video')
         
-        # Generate PDF report
-        pdf_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{session_id}_report.pdf")
-        generate_pdf_report(summary, pdf_path, file_type)
+        # Totals for the results pages, computed once instead of per request
+        enrich_summary(summary, file_type)
         
-        # Save summary as JSON
+        # Save summary as compact JSON (machine-read; orjson-backed when installed)
         summary_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{session_id}_summary.json")
-        with open(summary_path, 'w') as f:
-            json.dump(summary, f, indent=2)
+        with atomic_output(summary_path) as tmp_path, open(tmp_path, 'w', buffering=1 << 20) as f:
+            f.write(app.json.dumps(summary, separators=(',', ':')))
+        
+        # Complete: results are viewable now, the PDF report follows in the background
+        pdf_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{session_id}_report.pdf")
+        progress_store.update(session_id, progress=100, status='completed', result_path=result_path,
+                              pdf_path=pdf_path, pdf_ready=False, summary=summary)
+        progress_store.publish(session_id)
+        progress_values.pop(session_id, None)  # Only once the store no longer says 'processing'
         
-        # Complete
-        progress_tracker[session_id]['progress'] = 100
-        progress_tracker[session_id]['status'] = 'completed'
-        progress_tracker[session_id]['result_path'] = result_path
-        progress_tracker[session_id]['pdf_path'] = pdf_path
-        progress_tracker[session_id]['summary'] = summary
+        REPORT_EXECUTOR.submit(generate_report_async, session_id, summary, pdf_path, file_type)
         
     except Exception as e:
         print(f"Error processing file: {e}")
-        progress_tracker[session_id]['status'] = 'error'
-        progress_tracker[session_id]['error'] = str(e)
+        progress_store.update(session_id, status='error', error=str(e))
+        progress_store.publish(session_id)
+        progress_values.pop(session_id, None)
+
+def generate_report_async(session_id, summary, pdf_path, file_type):
+    """Generate the PDF report for a completed session and mark it ready for download"""
+    # Nothing waits on this job's future, so every failure must end up in pdf_error
+    try:
+        if generate_pdf_report(summary, pdf_path, file_type):
+            progress_store.update(session_id, pdf_ready=True)
+        else:
+            progress_store.update(session_id, pdf_error='Report generation failed')
+    except Exception as e:
+        print(f"Error generating report: {e}")
+        progress_store.update(session_id, pdf_error=str(e))
+    progress_store.publish(session_id)
+
+def report_video_progress(session_id, video_progress):
+    """Store video progress (0-100) mapped onto the 10-90% analysis range"""
+    progress_store.update(session_id, progress=10 + (video_progress * 0.8))
+    progress_store.publish(session_id)
+
+def progress_snapshot(session_id):
+    """Current progress entry for a session, with live video progress folded in"""
+    progress_info = progress_store.get(session_id) or {'progress': 0, 'status': 'unknown'}
+    
+    video_progress = progress_values.get(session_id)
+    if video_progress is not None:
+        progress_info = dict(progress_info, progress=10 + (video_progress.value * 0.8))  # 10-90%
+    
+    return progress_info
 
 @app.route('/progress/<session_id>')
 def get_progress(session_id):
-    """Get processing progress"""
-    progress_info = progress_tracker.get(session_id, {'progress': 0, 'status': 'unknown'})
-    return jsonify(progress_info)
+    """Get processing progress (polling fallback for /progress_stream)"""
+    return jsonify(progress_snapshot(session_id))
+
+@app.route('/progress_stream/<session_id>')
+def stream_progress(session_id):
+    """Push processing progress as Server-Sent Events until the session finishes"""
+    def event_stream():
+        subscription = progress_store.subscribe(session_id)
+        last_payload = None
+        
+        try:
+            while True:
+                progress_info = progress_snapshot(session_id)
+                
+                # Only send changes; the summary is fetched by the results page, not streamed
+                payload = json.dumps({k: v for k, v in progress_info.items() if k != 'summary'})
+                if payload != last_payload:
+                    yield f"data: {payload}\n\n"
+                    last_payload = payload
+                
+                if progress_info.get('status') in ('completed', 'error', 'unknown'):
+                    break
+                
+                # Stage changes are published; video progress is sampled once a second
+                subscription.wait(timeout=1.0)
+        finally:
+            subscription.close()
+    
+    return Response(event_stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/results')
 def results():
@@ -160,7 +316,7 @@ def results():
         return redirect(url_for('upload_page'))
     
     session_id = session['session_id']
-    progress_info = progress_tracker.get(session_id, {})
+    progress_info = progress_store.get(session_id) or {}
     
     if progress_info.get('status') != 'completed':
         flash('Processing not completed yet.', 'warning')
@@ -171,7 +327,8 @@ def results():
     return render_template('results.html', 
                          summary=summary, 
                          session_id=session_id,
-                         file_type=session.get('file_type', 'unknown'))
+                         file_type=session.get('file_type', 'unknown'),
+                         pdf_ready=progress_info.get('pdf_ready', True))
 
 @app.route('/analytics')
 def analytics():
@@ -181,7 +338,7 @@ def analytics():
         return redirect(url_for('upload_page'))
     
     session_id = session['session_id']
-    progress_info = progress_tracker.get(session_id, {})
+    progress_info = progress_store.get(session_id) or {}
     
     if progress_info.get('status') != 'completed':
         flash('Processing not completed yet.', 'warning')
@@ -200,20 +357,27 @@ def download_file(file_type, session_id):
     try:
         if file_type == 'video' or file_type == 'image':
             # Download processed media file
-            progress_info = progress_tracker.get(session_id, {})
+            progress_info = progress_store.get(session_id) or {}
             result_path = progress_info.get('result_path')
             
             if result_path and os.path.exists(result_path):
-                return send_file(result_path, as_attachment=True)
+                return send_download(result_path)
             else:
                 flash('File not found', 'error')
                 return redirect(url_for('results'))
         
         elif file_type == 'report':
+            # Report still being generated: ask the client to retry shortly
+            progress_info = progress_store.get(session_id) or {}
+            if progress_info.get('pdf_error'):
+                return jsonify({'error': progress_info['pdf_error']}), 500
+            if progress_info.get('pdf_ready') is False:
+                return jsonify({'message': 'Report is being generated'}), 202, {'Retry-After': '2'}
+            
             # Download PDF report
             pdf_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{session_id}_report.pdf")
             if os.path.exists(pdf_path):
-                return send_file(pdf_path, as_attachment=True)
+                return send_download(pdf_path)
             else:
                 flash('Report not found', 'error')
                 return redirect(url_for('results'))
@@ -222,7 +386,7 @@ def download_file(file_type, session_id):
             # Download JSON summary
             summary_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{session_id}_summary.json")
             if os.path.exists(summary_path):
-                return send_file(summary_path, as_attachment=True)
+                return send_download(summary_path)
             else:
                 flash('Summary not found', 'error')
                 return redirect(url_for('results'))
@@ -235,59 +399,101 @@ def download_file(file_type, session_id):
         flash(f'Error downloading file: {str(e)}', 'error')
         return redirect(url_for('results'))
 
+def send_download(file_path):
+    """Send an output file as an attachment, via nginx when SECURE_DOWNLOAD_PREFIX or X_ACCEL_REDIRECT_PREFIX is set"""
+    secure_prefix = app.config['SECURE_DOWNLOAD_PREFIX']
+    if secure_prefix:
+        # Short-lived signed URL; nginx checks it against /verify and sends the file itself
+        filename = os.path.basename(file_path)
+        token = download_serializer.dumps(filename)
+        return redirect(f"{secure_prefix.rstrip('/')}/{token}/{filename}")
+    
+    accel_prefix = app.config['X_ACCEL_REDIRECT_PREFIX']
+    if accel_prefix:
+        # nginx serves the file itself from an internal location aliased to the output folder
+        filename = os.path.basename(file_path)
+        return Response(headers={
+            'X-Accel-Redirect': f"{accel_prefix.rstrip('/')}/{filename}",
+            'Content-Type': mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            'Content-Disposition': f'attachment; filename={filename}',
+        })
+    
+    # Conditional responses allow range requests (seeking, resumed downloads) and 304s;
+    # session files hold student data and change on reprocessing, so clients revalidate
+    # against the ETag and shared caches keep nothing
+    response = send_file(file_path, as_attachment=True, conditional=True)
+    response.cache_control.private = True
+    return response
+
+@app.route('/verify')
+def verify_download():
+    """nginx auth_request target: 204 if the original /secure/<token>/<file> URL is validly signed"""
+    _, _, path = request.headers.get('X-Original-URI', '').partition(app.config['SECURE_DOWNLOAD_PREFIX'] or '/secure')
+    token, _, filename = path.strip('/').partition('/')
+    
+    try:
+        signed_filename = download_serializer.loads(token, max_age=app.config['SECURE_DOWNLOAD_MAX_AGE'])
+    except BadSignature:  # Also covers expired tokens
+        return '', 403
+    
+    return ('', 204) if signed_filename == filename else ('', 403)
+
 @app.route('/api/analytics/<session_id>')
 def api_analytics(session_id):
     """API endpoint for analytics data"""
-    progress_info = progress_tracker.get(session_id, {})
+    # A completed session's summary never changes, so its payload is built once
+    analytics_data = _analytics_cache.get(session_id)
+    if analytics_data is not None:
+        return jsonify(analytics_data)
+    
+    progress_info = progress_store.get(session_id) or {}
     summary = progress_info.get('summary', {})
     
-    # Format data for charts
+    # Chart data is precomputed by enrich_summary when processing finishes;
+    # per-student rows are streamed separately by /api/analytics/<session_id>/students
     analytics_data = {
-        'engagement_overview': {},
-        'activity_breakdown': {},
-        'student_performance': {}
+        'engagement_overview': summary.get('engagement_overview', {}),
+        'activity_breakdown': summary.get('activity_breakdown', {}),
+        'students_url': url_for('api_analytics_students', session_id=session_id)
     }
     
-    if summary:
-        if 'total_students' in summary:  # Image analysis
-            analytics_data['engagement_overview'] = {
-                'attentive': summary.get('attentive_students', 0),
-                'distracted': summary.get('distracted_students', 0),
-                'engagement_rate': summary.get('engagement_rate', 0)
-            }
-            analytics_data['activity_breakdown'] = summary.get('activity_breakdown', {})
-        
-        elif 'student_analysis' in summary:  # Video analysis
-            student_analysis = summary['student_analysis']
-            
-            attentive_count = sum(1 for s in student_analysis.values() if s['classification'] == 'Attentive')
-            distracted_count = len(student_analysis) - attentive_count
-            total_students = len(student_analysis)
-            
-            analytics_data['engagement_overview'] = {
-                'attentive': attentive_count,
-                'distracted': distracted_count,
-                'engagement_rate': (attentive_count / total_students * 100) if total_students > 0 else 0
-            }
-            
-            # Aggregate activity breakdown
-            all_activities = {}
-            for student_data in student_analysis.values():
-                for activity, count in student_data.get('activity_breakdown', {}).items():
-                    all_activities[activity] = all_activities.get(activity, 0) + count
-            
-            analytics_data['activity_breakdown'] = all_activities
-            analytics_data['student_performance'] = student_analysis
+    if progress_info.get('status') == 'completed':
+        with _analytics_cache_lock:
+            if len(_analytics_cache) >= ANALYTICS_CACHE_SIZE:
+                del _analytics_cache[next(iter(_analytics_cache))]  # Oldest first
+            _analytics_cache[session_id] = analytics_data
     
     return jsonify(analytics_data)
 
+@app.route('/api/analytics/<session_id>/students')
+def api_analytics_students(session_id):
+    """Per-student analytics as NDJSON, one student per line, so clients can render rows as they arrive"""
+    progress_info = progress_store.get(session_id) or {}
+    student_analysis = progress_info.get('summary', {}).get('student_analysis', {})
+    
+    def generate():
+        for student_id, student_data in student_analysis.items():
+            yield app.json.dumps(dict(student_data, student_id=student_id), separators=(',', ':')) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
 # Cleanup task
-@app.before_request 
-def cleanup_files():
-    """Clean up old files on startup"""
-    if not hasattr(cleanup_files, 'has_run'):
-        cleanup_old_files()
-        cleanup_files.has_run = True
+def start_cleanup_schedule():
+    """Clean up old files now, then every CLEANUP_INTERVAL seconds, off the request path"""
+    if BackgroundScheduler is not None:
+        scheduler = BackgroundScheduler(daemon=True)
+        scheduler.add_job(cleanup_old_files, 'interval', seconds=CLEANUP_INTERVAL,
+                          next_run_time=datetime.now(), max_instances=1, coalesce=True)
+        scheduler.start()
+    else:
+        def cleanup_loop():
+            while True:
+                cleanup_old_files()
+                time.sleep(CLEANUP_INTERVAL)
+        
+        threading.Thread(target=cleanup_loop, name='mw-cleanup', daemon=True).start()
+
+start_cleanup_schedule()
 
 # Error handlers
 @app.errorhandler(413)
@@ -305,7 +305,7 @@ function createTimelineChart(summary) {
         const baseEngagement = studentCount > 0 ? totalEngagement / studentCount : 0;
         const variation = (Math.random() - 0.5) * 20; // ±10% variation
         engagementData.push(Math.max(0, Math.min(100, baseEngagement + variation)));
-    });
+    }
     
     charts.timeline = new Chart(ctx, {
         type: 'line',
@@ -523,11 +523,25 @@ function refreshAnalytics() {
         MindWatch.showLoading(refreshButton);
     }
     
-    // Fetch fresh data
+    // Fetch fresh totals, then the per-student rows (video only) as a stream
     fetch(`/api/analytics/${analyticsData.sessionId}`)
         .then(response => response.json())
         .then(data => {
-            analyticsData.summary = data;
+            const summary = analyticsData.summary;
+            summary.activity_breakdown = data.activity_breakdown;
+            summary.engagement_overview = data.engagement_overview;
+            
+            if (analyticsData.fileType !== 'video') return;
+            
+            const studentAnalysis = {};
+            return streamStudentAnalysis(data.students_url, student => {
+                const { student_id, ...studentData } = student;
+                studentAnalysis[student_id] = studentData;
+            }).then(() => {
+                summary.student_analysis = studentAnalysis;
+            });
+        })
+        .then(() => {
             refreshCharts();
             MindWatch.showNotification('Analytics data refreshed', 'success');
         })
@@ -542,6 +556,33 @@ function refreshAnalytics() {
         });
 }
 
+// Read an NDJSON response line by line, calling onRow for each parsed row as it arrives
+async function streamStudentAnalysis(url, onRow) {
+    const response = await fetch(url);
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+        
+        const lines = buffer.split('\n');
+        buffer = lines.pop();  // Keep a trailing partial line for the next chunk
+        lines.filter(line => line).forEach(line => onRow(JSON.parse(line)));
+        
+        if (done) break;
+    }
+    
+    if (buffer) {
+        onRow(JSON.parse(buffer));
+    }
+}
+
 function refreshCharts() {
     // Destroy existing charts
     Object.values(charts).forEach(chart => {
@@ -206,6 +206,34 @@ function handleFormSubmit(e) {
         submitButton.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>Uploading...';
     }
     
+    // Send the file as the raw request body so the server can stream it to disk
+    if (window.fetch) {
+        e.preventDefault();
+        fetch('/upload_stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/octet-stream',
+                'X-Filename': encodeURIComponent(selectedFile.name)
+            },
+            body: selectedFile
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.redirect) {
+                window.location.href = data.redirect;
+            } else {
+                MindWatch.hideLoading(submitButton);
+                showError(data.error || 'Upload failed. Please try again.');
+            }
+        })
+        .catch(error => {
+            console.error('Upload error:', error);
+            MindWatch.hideLoading(submitButton);
+            showError('Upload failed. Please try again.');
+        });
+        return false;
+    }
+    
     return true;
 }
 
@@ -270,6 +298,10 @@ function updateStatus(status) {
             text: 'Preparing analysis...',
             details: 'Initializing AI model and processing pipeline'
         },
+        'queued': {
+            text: 'Waiting in queue...',
+            details: 'Another analysis is running, yours starts next'
+        },
         'analyzing': {
             text: 'Analyzing content...',
             details: 'Detecting student activities and behaviors'
@@ -312,27 +344,35 @@ function updateStatus(status) {
 
 // Progress checking function
 function startProgressChecking(sessionId) {
+    // Prefer server-pushed updates; fall back to polling if the stream fails
+    if (window.EventSource) {
+        const source = new EventSource(`/progress_stream/${sessionId}`);
+        source.onmessage = event => {
+            if (handleProgressData(JSON.parse(event.data))) {
+                source.close();
+            }
+        };
+        source.onerror = () => {
+            source.close();
+            window.progressSource = null;
+            pollProgress(sessionId);
+        };
+        
+        // Store source for cleanup
+        window.progressSource = source;
+        return;
+    }
+    
+    pollProgress(sessionId);
+}
+
+function pollProgress(sessionId) {
     const checkInterval = setInterval(() => {
         fetch(`/progress/${sessionId}`)
             .then(response => response.json())
             .then(data => {
-                updateProgress(data.progress || 0);
-                updateStatus(data.status || 'processing');
-                
-                if (data.status === 'completed') {
-                    clearInterval(checkInterval);
-                    showSuccess('Analysis completed successfully!');
-                    
-                    // Redirect to results after a delay
-                    setTimeout(() => {
-                        window.location.href = '/results';
-                    }, 2000);
-                } else if (data.status === 'error') {
+                if (handleProgressData(data)) {
                     clearInterval(checkInterval);
-                    showError(data.error || 'Processing failed. Please try again.');
-                    
-                    // Show retry button
-                    showRetryOption();
                 }
             })
             .catch(error => {
@@ -345,6 +385,29 @@ function startProgressChecking(sessionId) {
     window.progressInterval = checkInterval;
 }
 
+// Apply a progress update; returns true once processing has finished
+function handleProgressData(data) {
+    updateProgress(data.progress || 0);
+    updateStatus(data.status || 'processing');
+    
+    if (data.status === 'completed') {
+        showSuccess('Analysis completed successfully!');
+        
+        // Redirect to results after a delay
+        setTimeout(() => {
+            window.location.href = '/results';
+        }, 2000);
+        return true;
+    } else if (data.status === 'error') {
+        showError(data.error || 'Processing failed. Please try again.');
+        
+        // Show retry button
+        showRetryOption();
+        return true;
+    }
+    return false;
+}
+
 function showRetryOption() {
     const statusText = document.getElementById('statusText');
     const statusDetails = document.getElementById('statusDetails');
@@ -407,6 +470,9 @@ window.addEventListener('beforeunload', function() {
     if (window.progressInterval) {
         clearInterval(window.progressInterval);
     }
+    if (window.progressSource) {
+        window.progressSource.close();
+    }
 });
 
 // Export functions for global use
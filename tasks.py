@@ -0,0 +1,33 @@
+import os
+
+try:
+    from celery import Celery
+except ImportError:
+    Celery = None
+
+# Processing runs in a Celery worker when a broker is configured and celery is
+# installed; otherwise routes.py keeps running jobs inside the web process.
+# Start the worker from the project directory (it shares uploads/ and outputs/):
+#   celery -A tasks worker --pool=solo       (GPU inference, one job at a time)
+#   celery -A tasks worker --pool=threads    (CPU inference)
+CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL")
+
+celery = None
+process_file_task = None
+
+if Celery is not None and CELERY_BROKER_URL:
+    celery = Celery("mindwatch", broker=CELERY_BROKER_URL)
+    celery.conf.update(
+        task_acks_late=True,  # A job lost with its worker is redelivered
+        worker_prefetch_multiplier=1,
+        worker_concurrency=int(os.environ.get("CELERY_CONCURRENCY", 1)),  # One per GPU
+    )
+
+    @celery.task(bind=True, name="mindwatch.process_file")
+    def process_file_task(self, session_id, file_path, file_type):
+        """Run the analysis for an uploaded file in the worker process"""
+        import app  # Loads the Flask config and routes, which own the analyzer and progress store
+        from routes import process_file_async
+        process_file_async(session_id, file_path, file_type, live_progress=False)
+elif CELERY_BROKER_URL:
+    print("CELERY_BROKER_URL is set but celery is not installed, processing in-process")
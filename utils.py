@@ -1,56 +1,92 @@
 import os
 import time
-from datetime import datetime, timedelta
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image as RLImage
+from collections import Counter
+from datetime import datetime
+import functools
+import contextlib
+from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
-import matplotlib.pyplot as plt
-import seaborn as sns
+from reportlab.lib.enums import TA_CENTER
 import numpy as np
-from io import BytesIO
-import base64
+
+def _header_table_commands(header_color, header_font_size):
+    return [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor(header_color)),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), header_font_size),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]
+
+# Report paragraph styles, shared by every report
+_STYLES = getSampleStyleSheet()
+NORMAL_STYLE = _STYLES['Normal']
+
+TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=24,
+    spaceAfter=30,
+    alignment=TA_CENTER,
+    textColor=colors.HexColor('#2c3e50')
+)
+
+HEADING_STYLE = ParagraphStyle(
+    'CustomHeading',
+    parent=_STYLES['Heading2'],
+    fontSize=16,
+    spaceAfter=12,
+    textColor=colors.HexColor('#34495e')
+)
+
+FOOTER_STYLE = ParagraphStyle(
+    'Footer',
+    parent=NORMAL_STYLE,
+    fontSize=10,
+    alignment=TA_CENTER,
+    textColor=colors.grey
+)
+
+# Report table styles and column widths, shared by every report
+ACTIVITY_TABLE_COMMANDS = _header_table_commands('#3498db', 12)
+STUDENT_TABLE_COMMANDS = _header_table_commands('#27ae60', 10)
+ACTIVITY_COL_WIDTHS = [2 * inch, inch, inch]
+STUDENT_COL_WIDTHS = [1.5 * inch, 1.4 * inch, 1.1 * inch, 1.1 * inch]
+
+@functools.lru_cache(maxsize=None)
+def _report_table_styles():
+    """(activity, student) TableStyles, built on the first report"""
+    from reportlab.platypus import TableStyle
+    return TableStyle(ACTIVITY_TABLE_COMMANDS), TableStyle(STUDENT_TABLE_COMMANDS)
 
 def generate_pdf_report(summary, output_path, file_type='video'):
     """Generate PDF report from analysis summary"""
+    # platypus is only needed here, so processes that never build a report skip importing it
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
+    
     try:
+        activity_table_style, student_table_style = _report_table_styles()
+        
         # Create document
-        doc = SimpleDocTemplate(output_path, pagesize=A4)
         story = []
-        styles = getSampleStyleSheet()
-        
-        # Custom styles
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            spaceAfter=30,
-            alignment=TA_CENTER,
-            textColor=colors.HexColor('#2c3e50')
-        )
-        
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=16,
-            spaceAfter=12,
-            textColor=colors.HexColor('#34495e')
-        )
         
         # Title
-        story.append(Paragraph("MindWatch Analysis Report", title_style))
+        story.append(Paragraph("MindWatch Analysis Report", TITLE_STYLE))
         story.append(Spacer(1, 20))
         
         # Report metadata
         timestamp = summary.get('timestamp', datetime.now().isoformat())
-        story.append(Paragraph(f"<b>Generated:</b> {timestamp}", styles['Normal']))
-        story.append(Paragraph(f"<b>Analysis Type:</b> {file_type.title()}", styles['Normal']))
+        story.append(Paragraph(f"<b>Generated:</b> {timestamp}", NORMAL_STYLE))
+        story.append(Paragraph(f"<b>Analysis Type:</b> {file_type.title()}", NORMAL_STYLE))
         story.append(Spacer(1, 20))
         
         # Executive Summary
-        story.append(Paragraph("Executive Summary", heading_style))
+        story.append(Paragraph("Executive Summary", HEADING_STYLE))
         
         if file_type == 'image':
             # Image analysis summary
@@ -65,7 +101,7 @@ def generate_pdf_report(summary, output_path, file_type='video'):
             <b>Distracted Students:</b> {distracted}<br/>
             <b>Overall Engagement Rate:</b> {engagement_rate:.1f}%
             """
-            story.append(Paragraph(summary_text, styles['Normal']))
+            story.append(Paragraph(summary_text, NORMAL_STYLE))
             
         elif file_type == 'video':
             # Video analysis summary
@@ -78,33 +114,26 @@ def generate_pdf_report(summary, output_path, file_type='video'):
             <b>Students Tracked:</b> {students_tracked}<br/>
             <b>Frames Analyzed:</b> {frames_analyzed}
             """
-            story.append(Paragraph(summary_text, styles['Normal']))
+            story.append(Paragraph(summary_text, NORMAL_STYLE))
         
         story.append(Spacer(1, 20))
         
         # Activity Breakdown
-        story.append(Paragraph("Activity Breakdown", heading_style))
+        story.append(Paragraph("Activity Breakdown", HEADING_STYLE))
         
         if 'activity_breakdown' in summary:
-            activity_data = []
-            activity_data.append(['Activity', 'Count', 'Percentage'])
+            activity_breakdown = summary['activity_breakdown']
+            total_activities = sum(activity_breakdown.values())
+            inv_total = (100.0 / total_activities) if total_activities > 0 else 0.0
             
-            total_activities = sum(summary['activity_breakdown'].values())
-            for activity, count in summary['activity_breakdown'].items():
-                percentage = (count / total_activities * 100) if total_activities > 0 else 0
-                activity_data.append([activity.title(), str(count), f"{percentage:.1f}%"])
+            activity_data = [['Activity', 'Count', 'Percentage']] + [
+                [activity.title(), str(count), f"{count * inv_total:.1f}%"]
+                for activity, count in activity_breakdown.items()
+            ]
             
-            activity_table = Table(activity_data)
-            activity_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3498db')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
+            # Fixed column widths spare ReportLab measuring every cell
+            activity_table = Table(activity_data, colWidths=ACTIVITY_COL_WIDTHS)
+            activity_table.setStyle(activity_table_style)
             
             story.append(activity_table)
         
@@ -112,46 +141,30 @@ def generate_pdf_report(summary, output_path, file_type='video'):
         
         # Student Analysis (for video)
         if file_type == 'video' and 'student_analysis' in summary:
-            story.append(Paragraph("Individual Student Performance", heading_style))
-            
-            student_data = []
-            student_data.append(['Student ID', 'Classification', 'Attentive %', 'Distracted %'])
+            story.append(Paragraph("Individual Student Performance", HEADING_STYLE))
             
-            for student_id, data in summary['student_analysis'].items():
-                student_data.append([
+            student_data = [['Student ID', 'Classification', 'Attentive %', 'Distracted %']] + [
+                [
                     student_id,
                     data['classification'],
                     f"{data['attentive_percentage']:.1f}%",
                     f"{data['distracted_percentage']:.1f}%"
-                ])
+                ]
+                for student_id, data in summary['student_analysis'].items()
+            ]
             
-            student_table = Table(student_data)
-            student_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#27ae60')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
+            student_table = Table(student_data, colWidths=STUDENT_COL_WIDTHS)
+            student_table.setStyle(student_table_style)
             
             story.append(student_table)
         
         # Footer
         story.append(Spacer(1, 40))
-        footer_style = ParagraphStyle(
-            'Footer',
-            parent=styles['Normal'],
-            fontSize=10,
-            alignment=TA_CENTER,
-            textColor=colors.grey
-        )
-        story.append(Paragraph("Generated by MindWatch - AI-Powered Classroom Engagement Analysis", footer_style))
+        story.append(Paragraph("Generated by MindWatch - AI-Powered Classroom Engagement Analysis", FOOTER_STYLE))
         
-        # Build PDF
-        doc.build(story)
+        # Build PDF next to the destination, then swap it in
+        with atomic_output(output_path) as tmp_path:
+            SimpleDocTemplate(tmp_path, pagesize=A4, pageCompression=1).build(story)
         print(f"✓ PDF report generated: {output_path}")
         return True
         
@@ -159,45 +172,57 @@ def generate_pdf_report(summary, output_path, file_type='video'):
         print(f"Error generating PDF report: {e}")
         return False
 
+@contextlib.contextmanager
+def atomic_output(path):
+    """
+    Yield a temporary path beside `path` to write to; it replaces `path` only if the block succeeds
+    
+    Readers (downloads, cleanup) never see a half-written file, and a failed write leaves no debris.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 def cleanup_old_files(max_age_hours=24):
     """Clean up old uploaded and output files"""
     try:
-        current_time = time.time()
+        cutoff = time.time() - max_age_hours * 3600  # Files modified before this are removed
         
         for folder in ['uploads', 'outputs']:
             if not os.path.exists(folder):
                 continue
-                
-            for filename in os.listdir(folder):
-                if filename.startswith('.'):  # Skip hidden files
-                    continue
+            
+            # scandir reuses the directory listing's entry info instead of a stat per path
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):  # Skip hidden files
+                        continue
                     
-                file_path = os.path.join(folder, filename)
-                
-                # Check file age
-                file_age = current_time - os.path.getmtime(file_path)
-                if file_age > (max_age_hours * 3600):  # Convert hours to seconds
-                    try:
-                        os.remove(file_path)
-                        print(f"Cleaned up old file: {file_path}")
-                    except Exception as e:
-                        print(f"Error removing file {file_path}: {e}")
+                    # Check file age
+                    if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                        try:
+                            os.remove(entry.path)
+                            print(f"Cleaned up old file: {entry.path}")
+                        except OSError as e:
+                            print(f"Error removing file {entry.path}: {e}")
         
         print("✓ File cleanup completed")
         
     except Exception as e:
         print(f"Error during file cleanup: {e}")
 
+# (threshold in seconds, unit name), largest first; the last entry catches everything below
+_UNITS = ((3600, 'hours'), (60, 'minutes'), (1, 'seconds'))
+
 def format_duration(seconds):
     """Format duration in seconds to human readable format"""
-    if seconds < 60:
-        return f"{seconds:.1f} seconds"
-    elif seconds < 3600:
-        minutes = seconds / 60
-        return f"{minutes:.1f} minutes"
-    else:
-        hours = seconds / 3600
-        return f"{hours:.1f} hours"
+    for threshold, name in _UNITS:
+        if seconds >= threshold or threshold == 1:
+            return f"{seconds / threshold:.1f} {name}"
 
 def calculate_engagement_metrics(summary, file_type='video'):
     """Calculate additional engagement metrics"""
@@ -214,12 +239,16 @@ def calculate_engagement_metrics(summary, file_type='video'):
         student_data = summary['student_analysis']
         
         if student_data:
-            attentive_percentages = [s['attentive_percentage'] for s in student_data.values()]
+            # One contiguous buffer instead of re-converting a list for every statistic
+            attentive_percentages = np.fromiter(
+                (s['attentive_percentage'] for s in student_data.values()),
+                dtype=np.float64, count=len(student_data)
+            )
             
-            metrics['avg_engagement'] = np.mean(attentive_percentages)
-            metrics['min_engagement'] = np.min(attentive_percentages)
-            metrics['max_engagement'] = np.max(attentive_percentages)
-            metrics['std_engagement'] = np.std(attentive_percentages)
+            metrics['avg_engagement'] = float(attentive_percentages.mean())
+            metrics['min_engagement'] = float(attentive_percentages.min())
+            metrics['max_engagement'] = float(attentive_percentages.max())
+            metrics['std_engagement'] = float(attentive_percentages.std())
     
     return metrics
 
@@ -255,3 +284,39 @@ def generate_chart_data(summary, file_type='video'):
         }
     
     return chart_data
+
+def enrich_summary(summary, file_type='video'):
+    """
+    Add the totals every results view needs to a finished summary, in place
+    
+    Adds 'engagement_overview' (attentive, distracted, engagement_rate) and
+    'engagement_metrics'; video summaries also get an aggregated 'activity_breakdown'.
+    """
+    if file_type == 'image':
+        summary['engagement_overview'] = {
+            'attentive': summary.get('attentive_students', 0),
+            'distracted': summary.get('distracted_students', 0),
+            'engagement_rate': summary.get('engagement_rate', 0)
+        }
+        
+    elif file_type == 'video':
+        student_analysis = summary.get('student_analysis', {})
+        
+        # One pass over the students for the attentive count and the activity breakdown
+        attentive_count = 0
+        all_activities = Counter()
+        for student_data in student_analysis.values():
+            if student_data['classification'] == 'Attentive':
+                attentive_count += 1
+            all_activities.update(student_data.get('activity_breakdown', {}))
+        total_students = len(student_analysis)
+        
+        summary['engagement_overview'] = {
+            'attentive': attentive_count,
+            'distracted': total_students - attentive_count,
+            'engagement_rate': (attentive_count / total_students * 100) if total_students > 0 else 0
+        }
+        summary['activity_breakdown'] = dict(all_activities)
+    
+    summary['engagement_metrics'] = calculate_engagement_metrics(summary, file_type)
+    return summary